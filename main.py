@@ -11,6 +11,6 @@ from usagi.main import run
 if __name__ == '__main__':
     import sys
     if len(sys.argv) < 2:
-        print('Usage: python main.py <target_url>')
+        print('Usage: python main.py <target_url> [<target_url> ...]')
         sys.exit(1)
-    run(sys.argv[1])
+    run(*sys.argv[1:])
@@ -0,0 +1,26 @@
+import os
+import unittest
+
+os.environ.setdefault('GOOGLE_API_KEY', 'test')  # usagi.main exits at import without a key
+
+from usagi.main import parse_actions, try_parse_actions
+
+
+class ParseActionsTest(unittest.TestCase):
+    def test_skips_bracketed_prose_before_the_answer(self):
+        raw = 'Here are [3] options:\n[{"action_type":"click","target_id":8,"rationale":"open menu","confidence":0.9}]'
+        self.assertEqual(parse_actions(raw), [
+            {'action_type': 'click', 'target_id': 8, 'rationale': 'open menu', 'confidence': 0.9},
+        ])
+
+    def test_drops_non_object_elements(self):
+        raw = '[{"action_type":"click","target_id":1}, 3, "x"]'
+        self.assertEqual(parse_actions(raw), [{'action_type': 'click', 'target_id': 1}])
+
+    def test_no_actions_falls_back_to_noop(self):
+        self.assertIsNone(try_parse_actions('Here are [3] options, sorry.'))
+        self.assertEqual(parse_actions('Here are [3] options, sorry.')[0]['action_type'], 'noop')
+
+
+if __name__ == '__main__':
+    unittest.main()
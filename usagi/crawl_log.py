@@ -0,0 +1,50 @@
+"""Append-only on-disk log of discovered states and transitions, so a crawl can resume."""
+
+import json
+import os
+from typing import Dict, Any, Iterator
+
+FLUSH_EVERY = 50
+
+
+class CrawlLog:
+    """Buffers records in memory and appends them to a JSONL file in batches.
+
+    Two record kinds share the file:
+        {"state": <state_id>, "simhash": <int>, "url": ...}   a newly visited state
+        {"from": ..., "to": ..., "action": {...}}             a transition
+    """
+
+    def __init__(self, path: str, flush_every: int = FLUSH_EVERY):
+        self.path = path
+        self.flush_every = flush_every
+        self._buffer = []
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def load(self) -> Iterator[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # tolerate a torn last line from an interrupted run
+
+    def record_state(self, state_id: str, simhash: int, url: str):
+        self._append({'state': state_id, 'simhash': simhash, 'url': url})
+
+    def record_transition(self, transition: Dict[str, Any]):
+        self._append(transition)
+
+    def _append(self, record: Dict[str, Any]):
+        self._buffer.append(record)
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in self._buffer))
+        self._buffer = []
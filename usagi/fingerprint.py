@@ -0,0 +1,76 @@
+"""SimHash fingerprints for collapsing near-duplicate DOM states.
+
+The exact state fingerprint (dom_finger) is computed in the browser by the observe script.
+"""
+
+import hashlib
+from typing import Dict, Any, Iterator, Optional
+from urllib.parse import urlsplit
+
+SIMHASH_BITS = 64
+SIMHASH_MAX_DISTANCE = 1  # SimHash over a few dozen features is noisy; keep merges conservative
+
+
+def _elements(dom: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield from dom.get('clickables', [])
+    yield from dom.get('fillables', [])
+
+
+def _hash64(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def _features(dom: Dict[str, Any]) -> set:
+    # A set, not counts: repeated chrome (a dozen nav links) must not outweigh the content
+    features = {f"path:{urlsplit(dom.get('url', '')).path}"}
+    for el in _elements(dom):
+        attrs = el.get('attrs', {})
+        features.add(f"{el.get('tag', '')}.{attrs.get('class', '')}")
+        if el.get('text'):
+            features.add(f"text:{el['text']}")
+        if attrs.get('href'):
+            features.add(f"href:{attrs['href']}")
+        if attrs.get('name'):
+            features.add(f"name:{attrs['name']}")
+    return features
+
+
+def dom_simhash(dom: Dict[str, Any]) -> int:
+    """SimHash over the set of structural, text and link features of the page's elements."""
+    v = [0] * SIMHASH_BITS
+    for feature in _features(dom):
+        hv = _hash64(feature)
+        for i in range(SIMHASH_BITS):
+            v[i] += 1 if (hv >> i) & 1 else -1
+    return sum(1 << i for i in range(SIMHASH_BITS) if v[i] > 0)
+
+
+class SimHashIndex:
+    """Maps SimHash values to state ids and finds states within `max_distance` bits.
+
+    Matches are only made between states at the same URL. Uses the pigeonhole trick:
+    split the hash into max_distance + 1 bands; any two hashes within the distance
+    share at least one band exactly.
+    """
+
+    def __init__(self, max_distance: int = SIMHASH_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = SIMHASH_BITS // self.bands
+        self._buckets = {}  # {(url, band, value): [(simhash, state_id)]}
+
+    def _keys(self, simhash: int, url: str):
+        mask = (1 << self.band_bits) - 1
+        for b in range(self.bands):
+            yield (url, b, (simhash >> (b * self.band_bits)) & mask)
+
+    def get_near(self, simhash: int, url: str) -> Optional[str]:
+        for key in self._keys(simhash, url):
+            for other, state_id in self._buckets.get(key, []):
+                if bin(simhash ^ other).count('1') <= self.max_distance:
+                    return state_id
+        return None
+
+    def add(self, simhash: int, state_id: str, url: str):
+        for key in self._keys(simhash, url):
+            self._buckets.setdefault(key, []).append((simhash, state_id))
@@ -1,13 +1,24 @@
 from typing import Optional, Mapping, Any
+import asyncio
 import os
 
+from google.api_core import exceptions as google_exceptions
 from langchain_core.prompts import PromptTemplate
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
 try:
     # chat model provided by the langchain-google-genai integration
     from langchain_google_genai import ChatGoogleGenerativeAI
 except Exception as e:
     raise ImportError("langchain_google_genai (ChatGoogleGenerativeAI) is required by usagi.google_llm") from e
 
+# Rate-limit / overload errors are retried with backoff instead of failing the step
+_retry_transient = retry(
+    wait=wait_exponential_jitter(initial=0.5, max=8),
+    stop=stop_after_attempt(5),
+    retry=retry_if_exception_type((google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable)),
+    reraise=True,
+)
+
 
 class GoogleGenerativeLLM:
     """Small adapter that exposes a callable interface compatible with prior code.
@@ -15,9 +26,10 @@ class GoogleGenerativeLLM:
     Usage:
         llm = GoogleGenerativeLLM(model_name="gemini-2.0-flash")
         text = llm("Hello")
+        text = await llm.acall("Hello")
     """
 
-    def __init__(self, model_name: str = "gemini-2.0-flash-exp", api_key: Optional[str] = None, temperature: float = 0.2):
+    def __init__(self, model_name: str = "gemini-2.0-flash-exp", api_key: Optional[str] = None, temperature: float = 0.2, max_concurrency: int = 8):
         self.model_name = model_name
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
         if not self.api_key:
@@ -27,25 +39,61 @@ class GoogleGenerativeLLM:
 
         # instantiate the LangChain model wrapper
         # Note: ChatGoogleGenerativeAI expects parameters such as `model` and `google_api_key`.
+        # Its own tenacity retry is limited to a single attempt so _retry_transient (and the
+        # single-flight throttle below) is the only retry policy in effect.
         self.llm = ChatGoogleGenerativeAI(
             model=self.model_name, 
             google_api_key=self.api_key, 
-            temperature=self.temperature
+            temperature=self.temperature,
+            max_retries=1
         )
 
         # Create a simple prompt template for consistent interface
         self.prompt_template = PromptTemplate.from_template("{prompt}")
+        # Build the chain once so repeated calls reuse the same client
+        self.chain = self.prompt_template | self.llm
+
+        # Caps in-flight async calls; while the API keeps answering 429, calls go one at a time
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._single_flight = asyncio.Lock()
+        self._rate_limited = False
 
     def __call__(self, prompt: str) -> str:
         # Use the newer LangChain invoke pattern with prompt | llm
         try:
-            chain = self.prompt_template | self.llm
-            result = chain.invoke({"prompt": prompt})
+            result = self._invoke(prompt)
             # result is an AIMessage object, extract content
             return result.content if hasattr(result, 'content') else str(result)
         except Exception as e:
             # surface a clearer error for the caller
             raise RuntimeError(f"Google LLM call failed: {e}") from e
 
+    async def acall(self, prompt: str) -> str:
+        # Async variant so the crawler can overlap the round-trip with browser work
+        try:
+            async with self._semaphore:
+                if self._rate_limited:
+                    async with self._single_flight:
+                        result = await self._ainvoke(prompt)
+                else:
+                    result = await self._ainvoke(prompt)
+            return result.content if hasattr(result, 'content') else str(result)
+        except Exception as e:
+            raise RuntimeError(f"Google LLM call failed: {e}") from e
+
+    @_retry_transient
+    def _invoke(self, prompt: str):
+        return self.chain.invoke({"prompt": prompt})
+
+    @_retry_transient
+    async def _ainvoke(self, prompt: str):
+        try:
+            result = await self.chain.ainvoke({"prompt": prompt})
+        except google_exceptions.ResourceExhausted:
+            self._rate_limited = True
+            raise
+        self._rate_limited = False
+        return result
+
     def _identifying_params(self) -> Mapping[str, Any]:
         return {"model_name": self.model_name, "temperature": self.temperature}
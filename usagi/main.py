@@ -3,12 +3,20 @@ Package entrypoint for the USAGI crawler. This file contains the crawler logic m
 """
 
 import sys
+import asyncio
 import json
+import re
 import hashlib
+import weakref
 import time
-from typing import List, Dict, Any
+from collections import deque
+from typing import List, Dict, Any, Optional
 import requests
-from playwright.sync_api import sync_playwright, Page
+from playwright.async_api import async_playwright, Browser, Page
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from playwright.async_api import Error as PlaywrightError
+from usagi.fingerprint import dom_simhash, SimHashIndex
+from usagi.crawl_log import CrawlLog
 import os
 from dotenv import load_dotenv
 load_dotenv()
@@ -21,94 +29,227 @@ LLM_MODEL = os.getenv('LLM_MODEL', 'gemini-2.0-flash-exp')
 MAX_STEPS = 200
 ACTION_TRY_LIMIT = 3
 LLM_TEMPERATURE = 0.2
+PLAN_BATCH_SIZE = 4  # max planner prompts merged into one Gemini request
+PLAN_BATCH_WINDOW = 0.05  # seconds to wait for other contexts before sending a batch
+CAPTURE_SCREENSHOTS = os.getenv('USAGI_SCREENSHOTS', '0') == '1'  # screenshots are not used by the planner
+CAPTURE_A11Y = os.getenv('USAGI_CAPTURE_A11Y', '0') == '1'  # nor is the accessibility tree
+PLAN_CACHE_SIZE = 4096  # planner responses kept per crawl
+PLAN_CACHE_TTL = 600  # seconds before a cached planner response is considered stale
+CRAWL_CONCURRENCY = int(os.getenv('USAGI_CONCURRENCY', '4'))  # browser contexts crawling at once
+STATE_DIR = os.getenv('USAGI_STATE_DIR', '.usagi')  # where per-site crawl logs are kept for resuming
+MAX_TRANSITIONS_IN_MEMORY = 50_000  # older transitions only live in the crawl log
+OBSERVE_ATTEMPTS = 3  # observe retries when a navigation destroys the page's execution context
+PW_INSPECT_STACK = os.getenv('PW_INSPECT_STACK', '0') == '1'  # keep Playwright's per-call stack capture (debugging)
 
 
-def sha256_bytes(b: bytes) -> str:
-    return hashlib.sha256(b).hexdigest()
+def hash_bytes(b: bytes) -> str:
+    return hashlib.blake2b(b, digest_size=8).hexdigest()
 
 
 def short(s: str, n: int = 200) -> str:
     return s if len(s) <= n else s[:n] + '...'
 
 
-def observe(page: Page) -> Dict[str, Any]:
-    dom = page.evaluate('''() => {
-        function cloneNode(n){
-            const attrsToKeep = ['id','class','name','placeholder','aria-label','role','href','type','title','alt','value'];
-            const o = {tag: n.tagName.toLowerCase(), attrs: {}, text: ''};
-            for(const a of Array.from(n.attributes || [])){
-                if (attrsToKeep.includes(a.name)) o.attrs[a.name] = a.value;
-            }
-            o.text = (n.textContent || '').trim().slice(0,200);
-            return o;
+# Registered once per context with add_init_script, so each observe only sends a short call
+# expression over CDP instead of re-sending (and re-parsing) the whole function body.
+_OBSERVE_JS = '''window.__usagi_observe = (reset) => {
+    const attrsToKeep = ['id','class','name','placeholder','aria-label','role','href','type','title','alt','value'];
+    function hashStr(s){
+        let h = 0x811c9dc5;
+        for (let i = 0; i < s.length; i++){ h ^= s.charCodeAt(i); h = Math.imul(h, 0x01000193); }
+        return h >>> 0;
+    }
+
+    // 64-bit FNV-1a over url, title and tag/id/class/role/name/text of every matched element
+    // (including those past the payload cap) gives the state fingerprint without Python having to serialize and hash the DOM
+    let finger = 14695981039346656037n;
+    const mix = (s) => {
+        for (let i = 0; i < s.length; i++){
+            finger ^= BigInt(s.charCodeAt(i));
+            finger = (finger * 1099511628211n) & 0xFFFFFFFFFFFFFFFFn;
         }
-        
-        // Generate unique IDs for elements
-        let idCounter = 0;
-        
-        // Collect clickable elements with IDs
-        const clickables = Array.from(document.querySelectorAll('a,button,input[type=button],input[type=submit],[role=button]'))
-            .slice(0,100).map(el => {
-                const info = cloneNode(el);
-                info.element_id = idCounter++;
-                el.setAttribute('data-usagi-id', info.element_id);
-                try{ info.accessible = el.getAttribute && (el.getAttribute('aria-label') || el.getAttribute('title') || ''); }catch(e){info.accessible=''}
-                return info;
-            });
-        
-        // Collect fillable elements (input, textarea) with IDs
-        const fillables = Array.from(document.querySelectorAll('input:not([type=button]):not([type=submit]):not([type=hidden]),textarea,select'))
-            .slice(0,100).map(el => {
-                const info = cloneNode(el);
-                info.element_id = idCounter++;
-                el.setAttribute('data-usagi-id', info.element_id);
-                try{ 
-                    info.accessible = el.getAttribute && (el.getAttribute('aria-label') || el.getAttribute('title') || el.getAttribute('placeholder') || '');
-                    info.current_value = el.value || '';
-                }catch(e){
-                    info.accessible='';
-                    info.current_value='';
-                }
-                return info;
-            });
-            
-        return {title: document.title || '', url: location.href, clickables, fillables};
-    }''')
+        finger = (finger * 1099511628211n) & 0xFFFFFFFFFFFFFFFFn;  // token separator (FNV step for a 0 byte)
+    };
+    mix(location.href);
+    mix(document.title || '');
+
+    const prev = (!reset && window.__usagi_prev) || {};
+    const next = {};
+    const changed = [];
+    const clickableIds = [];
+    const fillableIds = [];
+
+    // Element IDs are stable: nodes keep the data-usagi-id they were given on an
+    // earlier observe and only untagged nodes get a fresh one
+    let idCounter = window.__usagi_next_id;
+    if (idCounter === undefined){
+        idCounter = 0;
+        for (const el of document.querySelectorAll('[data-usagi-id]')){
+            idCounter = Math.max(idCounter, Number(el.getAttribute('data-usagi-id')) + 1);
+        }
+    }
+    const seen = new Set();
+
+    // One pass over clickables and fillables, branching per element
+    for (const el of document.querySelectorAll('a,button,input,textarea,select,[role=button]')){
+        const tag = el.tagName.toLowerCase();
+        const type = (el.getAttribute('type') || '').toLowerCase();
+        let fillable = false;
+        if (tag === 'input'){
+            if (type === 'hidden') continue;
+            fillable = type !== 'button' && type !== 'submit';
+        } else if (tag === 'textarea' || tag === 'select'){
+            fillable = true;
+        }
+        // Fillables carry no text; reading textContent on inputs is wasted work
+        const text = fillable ? '' : (el.textContent || '').trim().slice(0,80);
+        mix(tag); mix(el.getAttribute('id') || ''); mix(el.getAttribute('class') || '');
+        mix(el.getAttribute('role') || ''); mix(el.getAttribute('name') || ''); mix(text);
+
+        // The planner shows 12 of each kind; keep a little headroom but no more
+        const ids = fillable ? fillableIds : clickableIds;
+        if (ids.length >= 20) continue;
+
+        const info = {tag, attrs: {}};
+        for (const a of el.attributes){
+            if (attrsToKeep.includes(a.name)) info.attrs[a.name] = a.value;
+        }
+        if (fillable){
+            info.accessible = info.attrs['aria-label'] || info.attrs['title'] || info.attrs['placeholder'] || '';
+            info.current_value = el.value || '';
+        } else {
+            info.text = text;
+            info.accessible = info.attrs['aria-label'] || info.attrs['title'] || '';
+        }
+        let eid = el.getAttribute('data-usagi-id');
+        if (eid === null || seen.has(eid)){  // also re-tag nodes cloned with an existing id
+            eid = String(idCounter++);
+            el.setAttribute('data-usagi-id', eid);
+        }
+        seen.add(eid);
+        info.element_id = Number(eid);
+        ids.push(info.element_id);
 
-    try:
-        a11y = page.accessibility.snapshot()
-    except Exception:
-        a11y = {}
+        const elHash = hashStr(tag + '|' + JSON.stringify(info.attrs) + '|' + (info.text || '') + '|' + (info.current_value || ''));
+        next[info.element_id] = elHash;
+        if (prev[info.element_id] !== elHash) changed.push(info);
+    }
+    window.__usagi_prev = next;
+    window.__usagi_next_id = idCounter;
+
+    return {title: document.title || '', url: location.href, clickable_ids: clickableIds, fillable_ids: fillableIds, changed, dom_finger: finger.toString(16).padStart(16, '0')};
+}'''
+
+
+# Random id among the observed state's clickables that is still attached and not yet clicked, or null
+_PICK_UNCLICKED_JS = '''([ids, clicked]) => {
+    const done = new Set(clicked);
+    const cands = ids.filter(eid => !done.has(eid) && document.querySelector(`[data-usagi-id="${eid}"]`));
+    return cands.length ? cands[Math.floor(Math.random() * cands.length)] : null;
+}'''
+
+
+# Per-page element cache that observe_dom merges deltas into: {page: {element_id: info}}
+_dom_cache = weakref.WeakKeyDictionary()
+
+
+async def observe_dom(page: Page) -> Dict[str, Any]:
+    """Collect the DOM snapshot and fingerprint; enough to identify the state and plan."""
+    cache = _dom_cache.get(page)
+    for attempt in range(OBSERVE_ATTEMPTS):
+        try:
+            # The browser only sends elements whose hash changed since the previous call
+            delta = await page.evaluate('(reset) => window.__usagi_observe && window.__usagi_observe(reset)', cache is None)
+            if delta is None:
+                # Page created before the init script was registered; install it on the fly
+                await page.evaluate(_OBSERVE_JS)
+                delta = await page.evaluate('(reset) => window.__usagi_observe(reset)', cache is None)
+            break
+        except PlaywrightError as e:
+            # A click that started a navigation tears down the document mid-evaluate
+            if 'Execution context was destroyed' not in str(e) or attempt == OBSERVE_ATTEMPTS - 1:
+                raise
+            try:
+                await page.wait_for_load_state('domcontentloaded', timeout=5000)
+            except PlaywrightTimeoutError:
+                pass
 
-    screenshot_bytes = page.screenshot(type='png', full_page=False)
-    screenshot_hash = sha256_bytes(screenshot_bytes)
+    if cache is None:
+        cache = {}
+    for info in delta['changed']:
+        cache[info['element_id']] = info
+    # Drop elements that left the page; IDs are stable so the cache would otherwise grow
+    cache = _dom_cache[page] = {eid: cache[eid] for eid in delta['clickable_ids'] + delta['fillable_ids']}
+    dom = {
+        'title': delta['title'],
+        'url': delta['url'],
+        'clickables': [cache[eid] for eid in delta['clickable_ids']],
+        'fillables': [cache[eid] for eid in delta['fillable_ids']],
+    }
 
-    dom_finger = sha256_bytes(json.dumps(dom, sort_keys=True).encode('utf-8'))
+    dom_finger = delta['dom_finger']
 
     summary = f"{dom.get('title','')} {dom.get('url','')} clickables:{len(dom.get('clickables',[]))} fillables:{len(dom.get('fillables',[]))}"
 
     return {
         'dom': dom,
-        'a11y': a11y,
-        'screenshot': screenshot_bytes,
-        'screenshot_hash': screenshot_hash,
         'dom_finger': dom_finger,
+        'simhash': dom_simhash(dom),
         'summary': summary
     }
 
 
-def make_planner_prompt(state_summary: str, clickables: List[Dict[str, Any]], fillables: List[Dict[str, Any]], clicked_ids: set = None) -> str:
+async def observe_extras(page: Page, state: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill in the optional accessibility tree and screenshot; safe to run while the planner is in flight."""
+    async def a11y_snapshot():
+        if not CAPTURE_A11Y:
+            return None
+        try:
+            return await page.accessibility.snapshot()
+        except Exception:
+            return {}
+
+    async def screenshot():
+        if not CAPTURE_SCREENSHOTS:
+            return b''
+        # JPEG of a fixed viewport clip is ~10x smaller and cheaper to encode than a PNG
+        return await page.screenshot(type='jpeg', quality=40, clip={'x': 0, 'y': 0, 'width': 1024, 'height': 768})
+
+    a11y, screenshot_bytes = await asyncio.gather(a11y_snapshot(), screenshot())
+
+    if a11y is not None:
+        state['a11y'] = a11y
+    state['screenshot'] = screenshot_bytes
+    state['screenshot_hash'] = hash_bytes(screenshot_bytes) if screenshot_bytes else ''
+    return state
+
+
+# Shared by the single-state and batched planner prompts
+_ACTION_FIELDS = """- action_type: "click" | "fill" | "navigate" | "noop"
+- target_id: element_id (required, use the ID: number shown above)
+- fill_value: (optional, only for fill actions, suggest realistic test values)
+- rationale: short explanation
+- confidence: 0.0 to 1.0"""
+
+_MISSION = "Mission: Explore the site and find new unique states. Prefer elements not in CLICKED_IDS and filling forms."
+
+
+def make_state_section(state_summary: str, clickables: List[Dict[str, Any]], fillables: List[Dict[str, Any]], clicked_ids: set = None) -> str:
+    """Page summary plus the clickable/fillable element listing for one state."""
     if clicked_ids is None:
         clicked_ids = set()
     
-    # Format clickables with ID and clicked status
+    # Format clickables with ID; clicked status goes in one compact CLICKED_IDS line
     clickable_lines = []
+    clicked_shown = []
     for c in clickables[:12]:
         eid = c.get('element_id', '?')
-        clicked = '✓' if eid in clicked_ids else ' '
-        line = f"[{clicked}] ID:{eid} tag:{c.get('tag')}, text:{short(c.get('text',''))}, aria:{short(c.get('attrs',{}).get('aria-label','') or c.get('accessible',''))}, attr_id:{c.get('attrs',{}).get('id','')}"
+        if eid in clicked_ids:
+            clicked_shown.append(str(eid))
+        line = f"ID:{eid} tag:{c.get('tag')}, text:{short(c.get('text',''))}, aria:{short(c.get('attrs',{}).get('aria-label','') or c.get('accessible',''))}, attr_id:{c.get('attrs',{}).get('id','')}"
         clickable_lines.append(line)
     clickables_text = '\n'.join(clickable_lines)
+    clicked_text = ','.join(clicked_shown) if clicked_shown else '(none)'
     
     # Format fillables with ID
     fillable_lines = []
@@ -118,23 +259,24 @@ def make_planner_prompt(state_summary: str, clickables: List[Dict[str, Any]], fi
         fillable_lines.append(line)
     fillables_text = '\n'.join(fillable_lines) if fillable_lines else "(none)"
     
-    prompt = f"""
-You are a web testing planner. Current page summary:
+    return f"""Current page summary:
 {state_summary}
 
-Clickable elements (✓ = already clicked in this state):
+Clickable elements:
 {clickables_text}
+CLICKED_IDS (already clicked in this state): {clicked_text}
 
 Fillable elements:
-{fillables_text}
+{fillables_text}"""
+
+
+def make_planner_prompt(state_summary: str, clickables: List[Dict[str, Any]], fillables: List[Dict[str, Any]], clicked_ids: set = None) -> str:
+    prompt = f"""
+You are a web testing planner. {make_state_section(state_summary, clickables, fillables, clicked_ids)}
 
-Mission: Explore the site and find new unique states. Prefer unclicked elements [ ] and filling forms.
+{_MISSION}
 Return a JSON array of up to 3 actions. Each action must be an object with fields:
-- action_type: "click" | "fill" | "navigate" | "noop"
-- target_id: element_id (required, use the ID: number shown above)
-- fill_value: (optional, only for fill actions, suggest realistic test values)
-- rationale: short explanation
-- confidence: 0.0 to 1.0
+{_ACTION_FIELDS}
 
 Example:
 [
@@ -150,10 +292,13 @@ Make sure output is pure JSON.
 from usagi.google_llm import GoogleGenerativeLLM
 
 
-def call_llm(prompt: str) -> str:
-    llm = GoogleGenerativeLLM(model_name=LLM_MODEL, api_key=GOOGLE_API_KEY, temperature=LLM_TEMPERATURE)
+def make_llm() -> GoogleGenerativeLLM:
+    return GoogleGenerativeLLM(model_name=LLM_MODEL, api_key=GOOGLE_API_KEY, temperature=LLM_TEMPERATURE)
+
+
+async def call_llm(prompt: str, llm: GoogleGenerativeLLM) -> str:
     try:
-        return llm(prompt)
+        return await llm.acall(prompt)
     except Exception as e:
         print('Google LLM error:', e)
         print('Planner will fallback to exploration (empty actions).')
@@ -161,40 +306,257 @@ def call_llm(prompt: str) -> str:
 
 
 
-def plan_actions(state: Dict[str, Any], clicked_ids: set = None) -> List[Dict[str, Any]]:
-    if clicked_ids is None:
-        clicked_ids = set()
-    prompt = make_planner_prompt(
-        state['summary'], 
-        state['dom']['clickables'], 
-        state['dom'].get('fillables', []),
-        clicked_ids
-    )
-    raw = call_llm(prompt)
+def extract_json_array(raw: str, start: int = 0) -> str:
+    """Return the first balanced [...] span in raw at or after start (string-aware), or ''."""
+    start = raw.find('[', start)
+    if start < 0:
+        return ''
+    depth = 0
+    in_str = False
+    escaped = False
+    for i in range(start, len(raw)):
+        c = raw[i]
+        if in_str:
+            if escaped:
+                escaped = False
+            elif c == '\\':
+                escaped = True
+            elif c == '"':
+                in_str = False
+        elif c == '"':
+            in_str = True
+        elif c == '[':
+            depth += 1
+        elif c == ']':
+            depth -= 1
+            if depth == 0:
+                return raw[start:i + 1]
+    return ''
+
+
+def _as_actions(parsed: Any) -> Optional[List[Dict[str, Any]]]:
+    # Only objects are actions; a list with none (e.g. "[3]" in prose) is not an answer
+    if not isinstance(parsed, list):
+        return None
+    actions = [a for a in parsed if isinstance(a, dict)]
+    return actions if actions or not parsed else None
+
+
+def try_parse_actions(raw: str) -> Optional[List[Dict[str, Any]]]:
+    """Return the action list in raw, or None if it can't be parsed."""
     try:
-        parsed = json.loads(raw)
-        if isinstance(parsed, list):
-            return parsed
+        actions = _as_actions(json.loads(raw))
+        if actions is not None:
+            return actions
     except Exception:
-        import re
-        m = re.search(r"(\[.*\])", raw, re.S)
-        if m:
-            try:
-                parsed = json.loads(m.group(1))
-                if isinstance(parsed, list):
-                    return parsed
-            except Exception:
-                pass
+        pass
+    # Prose around the answer may contain other brackets; try each [...] span in turn
+    start = raw.find('[')
+    while start >= 0:
+        span = extract_json_array(raw, start)
+        if not span:
+            break
+        try:
+            actions = _as_actions(json.loads(span))
+            if actions is not None:
+                return actions
+        except Exception:
+            pass
+        start = raw.find('[', start + 1)
+    return None
+
+
+def parse_actions(raw: str) -> List[Dict[str, Any]]:
+    actions = try_parse_actions(raw)
+    if actions is not None:
+        return actions
     print('LLM 回傳無法解析為 JSON，原始回覆前 1000 字：')
     print(raw[:1000])
     return [{'action_type': 'noop', 'rationale': 'parse_failed', 'confidence': 0}]
 
 
+class PlanCache:
+    """Raw planner replies keyed on (dom_finger, element ids, clicked_ids), so revisited states skip the LLM.
+
+    The element ids are part of the key because a re-rendered page can keep its
+    dom_finger while its nodes get new data-usagi-ids; a reply naming the old ids
+    would be useless. Values are the raw LLM text (not parsed JSON) so parse_actions
+    still runs on hits.
+    """
+
+    def __init__(self, maxsize: int = PLAN_CACHE_SIZE, ttl: float = PLAN_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = {}  # {key: (stored_at, raw)}, insertion ordered
+
+    @staticmethod
+    def key(state: Dict[str, Any], clicked_ids: set) -> str:
+        dom = state['dom']
+        element_ids = ','.join(str(e['element_id']) for e in dom['clickables'] + dom.get('fillables', []))
+        return f"{state['dom_finger']}|{hash_bytes(element_ids.encode('utf-8'))}|{','.join(map(str, sorted(clicked_ids)))}"
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, raw = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        return raw
+
+    def put(self, key: str, raw: str):
+        if not raw:
+            return  # don't remember failed calls
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic(), raw)
+        while len(self._entries) > self.maxsize:
+            del self._entries[next(iter(self._entries))]
+
+
+def make_state_prompt(state: Dict[str, Any], clicked_ids: set) -> str:
+    return make_planner_prompt(
+        state['summary'],
+        state['dom']['clickables'],
+        state['dom'].get('fillables', []),
+        clicked_ids
+    )
+
+
+def make_batch_prompt(states: List[Dict[str, Any]], clicked_ids_list: List[set]) -> str:
+    blocks = '\n\n'.join(
+        f"===STATE {k}===\n" + make_state_section(state['summary'], state['dom']['clickables'], state['dom'].get('fillables', []), clicked_ids)
+        for k, (state, clicked_ids) in enumerate(zip(states, clicked_ids_list))
+    )
+    n = len(states)
+    return f"""
+You are a web testing planner. You will plan for {n} independent pages, each described in its own ===STATE k=== block.
+
+{blocks}
+
+{_MISSION}
+For every page choose up to 3 actions. Each action must be an object with fields:
+{_ACTION_FIELDS}
+
+Output format: for each page k from 0 to {n - 1}, in order, write a line ===RESULT k=== followed by that page's JSON array of actions. Output nothing else.
+"""
+
+
+async def plan_actions(state: Dict[str, Any], clicked_ids: set, llm: GoogleGenerativeLLM, cache: PlanCache = None) -> List[Dict[str, Any]]:
+    if clicked_ids is None:
+        clicked_ids = set()
+    key = PlanCache.key(state, clicked_ids)
+    raw = cache.get(key) if cache is not None else None
+    if raw is not None:
+        print('💾 Planner cache hit')
+        return parse_actions(raw)
+    prompt = make_state_prompt(state, clicked_ids)
+    raw = await call_llm(prompt, llm)
+    actions = try_parse_actions(raw)
+    if not actions:
+        return parse_actions(raw)
+    if cache is not None:
+        cache.put(key, raw)  # only replies that yielded real actions are worth replaying
+    return actions
+
+
+async def plan_actions_batch(states: List[Dict[str, Any]], clicked_ids_list: List[set], llm: GoogleGenerativeLLM, cache: PlanCache = None) -> List[List[Dict[str, Any]]]:
+    """Plan several states with a single LLM request; returns one action list per state."""
+    if len(states) == 1:
+        return [await plan_actions(states[0], clicked_ids_list[0], llm, cache)]
+
+    raw = await call_llm(make_batch_prompt(states, clicked_ids_list), llm)
+
+    # re.split yields [preamble, k0, body0, k1, body1, ...]
+    parts = re.split(r"===RESULT (\d+)===", raw)
+    indices = [int(k) for k in parts[1::2]]
+    if sorted(indices) != list(range(len(states))):
+        # Misnumbered, missing or duplicated results can't be matched to states safely
+        print(f'⚠ Batched planner reply has RESULT indices {indices}; re-planning {len(states)} states individually')
+        return list(await asyncio.gather(*(
+            plan_actions(state, clicked_ids, llm, cache) for state, clicked_ids in zip(states, clicked_ids_list)
+        )))
+    bodies = dict(zip(indices, parts[2::2]))
+    results = []
+    for k in range(len(states)):
+        actions = try_parse_actions(bodies[k])
+        if not actions:
+            results.append(parse_actions(bodies[k]))
+            continue
+        if cache is not None:
+            cache.put(PlanCache.key(states[k], clicked_ids_list[k]), bodies[k].strip())
+        results.append(actions)
+    return results
+
+
+class PlanBatcher:
+    """Collects planner requests from concurrent crawl contexts and sends them as one LLM call.
+
+    A batch is flushed once it reaches `max_batch` prompts or `window` seconds after
+    the first request arrived, whichever comes first.
+    """
+
+    def __init__(self, llm: GoogleGenerativeLLM, cache: PlanCache = None, max_batch: int = PLAN_BATCH_SIZE, window: float = PLAN_BATCH_WINDOW):
+        self.llm = llm
+        self.cache = cache
+        self.max_batch = max_batch
+        self.window = window
+        self._pending = []  # [(state, clicked_ids, future)]
+        self._timer = None
+        self._tasks = set()  # the loop only keeps weak refs to tasks; hold in-flight sends here
+
+    async def plan(self, state: Dict[str, Any], clicked_ids: set) -> List[Dict[str, Any]]:
+        if self.cache is not None:
+            raw = self.cache.get(PlanCache.key(state, clicked_ids))
+            if raw is not None:
+                print('💾 Planner cache hit')
+                return parse_actions(raw)
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((state, clicked_ids, fut))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await fut
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch):
+        try:
+            results = await plan_actions_batch([b[0] for b in batch], [b[1] for b in batch], self.llm, self.cache)
+        except Exception as e:
+            for _, _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, _, fut), actions in zip(batch, results):
+            if not fut.done():
+                fut.set_result(actions)
+
+
+async def wait_for_settle(page: Page):
+    """Wait for the page to settle after an action, bounded so slow pages don't stall the crawl."""
+    try:
+        await page.wait_for_load_state('domcontentloaded', timeout=1500)
+        await page.wait_for_load_state('networkidle', timeout=800)
+    except PlaywrightTimeoutError:
+        pass
+
+
 def escape_for_text_selector(s: str) -> str:
     return s.replace('\\', '\\\\').replace('/', '\\/')
 
 
-def find_and_act(page: Page, action: Dict[str, Any], clickables: List[Dict[str, Any]], fillables: List[Dict[str, Any]]) -> Dict[str, Any]:
+async def find_and_act(page: Page, action: Dict[str, Any], clickables: List[Dict[str, Any]], fillables: List[Dict[str, Any]]) -> Dict[str, Any]:
     """Execute an action using element_id for precise targeting."""
     action_type = action.get('action_type', 'noop')
     target_id = action.get('target_id')
@@ -205,16 +567,16 @@ def find_and_act(page: Page, action: Dict[str, Any], clickables: List[Dict[str,
     if target_id is None:
         return {'ok': False, 'reason': 'no_target_id'}
     
+    # Find element by data-usagi-id attribute; building a locator costs no round-trip.
+    # click()/fill() already scroll into view and overwrite the value, so each action is one call.
+    element = page.locator(f'[data-usagi-id="{target_id}"]').first
+
     try:
         # Handle FILL action
         if action_type == 'fill':
             fill_value = action.get('fill_value', '')
-            # Find element by data-usagi-id attribute
             try:
-                element = page.locator(f'[data-usagi-id="{target_id}"]').first
-                element.scroll_into_view_if_needed(timeout=3000)
-                element.clear(timeout=3000)
-                element.fill(fill_value, timeout=3000)
+                await element.fill(fill_value, timeout=3000)
                 print(f"  ✓ Filled element ID:{target_id} with '{fill_value}'")
                 return {'ok': True, 'action': 'fill', 'target_id': target_id}
             except Exception as e:
@@ -224,9 +586,7 @@ def find_and_act(page: Page, action: Dict[str, Any], clickables: List[Dict[str,
         # Handle CLICK action
         elif action_type == 'click':
             try:
-                element = page.locator(f'[data-usagi-id="{target_id}"]').first
-                element.scroll_into_view_if_needed(timeout=3000)
-                element.click(timeout=3000)
+                await element.click(timeout=3000)
                 print(f"  ✓ Clicked element ID:{target_id}")
                 return {'ok': True, 'action': 'click', 'target_id': target_id}
             except Exception as e:
@@ -235,10 +595,16 @@ def find_and_act(page: Page, action: Dict[str, Any], clickables: List[Dict[str,
         
         # Handle NAVIGATE action (for links)
         elif action_type == 'navigate':
+            clicked = False
             try:
-                element = page.locator(f'[data-usagi-id="{target_id}"]').first
-                element.scroll_into_view_if_needed(timeout=3000)
-                element.click(timeout=3000)
+                try:
+                    async with page.expect_navigation(timeout=3000):
+                        await element.click(timeout=3000)
+                        clicked = True
+                except PlaywrightTimeoutError:
+                    # Clicked but no navigation followed (e.g. in-page anchor); still a valid action
+                    if not clicked:
+                        raise
                 print(f"  ✓ Navigated via element ID:{target_id}")
                 return {'ok': True, 'action': 'navigate', 'target_id': target_id}
             except Exception as e:
@@ -253,56 +619,85 @@ def find_and_act(page: Page, action: Dict[str, Any], clickables: List[Dict[str,
         return {'ok': False, 'reason': f'exception: {e}'}
 
 
-def run(target_url: str):
-    import random
-    
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=False)
-        context = browser.new_context()
-        page = context.new_page()
-        page.goto(target_url, wait_until='domcontentloaded')
+async def crawl_context(browser: Browser, target_url: str, llm: GoogleGenerativeLLM, batcher: PlanBatcher = None, plan_cache: PlanCache = None) -> Dict[str, Any]:
+    """Crawl one site in its own browser context and return the discovered graph."""
+    visited = set()  # Only use dom_finger for state tracking (優先級3)
+    near_index = SimHashIndex()  # Collapses near-duplicate states onto an already visited one
+    transitions = deque(maxlen=MAX_TRANSITIONS_IN_MEMORY)
+    state_memory = {}  # Track clicked elements per state: {dom_finger: set(element_ids)}
+
+    # Resume: states found by earlier runs against the same URL count as visited
+    log = CrawlLog(os.path.join(STATE_DIR, hash_bytes(target_url.encode('utf-8')) + '.jsonl'))
+    for record in log.load():
+        if 'state' in record:
+            visited.add(record['state'])
+            near_index.add(record['simhash'], record['state'], record.get('url', ''))
+
+    def resolve_state_id(s: Dict[str, Any]) -> str:
+        # Exact match first, else a near-duplicate already visited at the same URL
+        if s['dom_finger'] in visited:
+            return s['dom_finger']
+        return near_index.get_near(s['simhash'], s['dom']['url']) or s['dom_finger']
 
-        visited = set()  # Only use dom_finger for state tracking (優先級3)
-        transitions = []
-        state_memory = {}  # Track clicked elements per state: {dom_finger: set(element_ids)}
+    resumed = len(visited)
+    if resumed:
+        print(f"📂 Resumed {resumed} known states from {log.path}")
+
+    context = await browser.new_context()
+    try:
+        await context.add_init_script(_OBSERVE_JS)
+        page = await context.new_page()
+        await page.goto(target_url, wait_until='domcontentloaded')
 
         for step in range(MAX_STEPS):
             print(f"\n===== STEP {step+1} =====")
-            state = observe(page)
-            
+            state = await observe_dom(page)
+
             # Use only dom_finger for state_id (優先級3 - 避免循環)
-            state_id = state['dom_finger']
-            
+            state_id = resolve_state_id(state)
+
             # Initialize clicked_ids for this state if not exists
             if state_id not in state_memory:
                 state_memory[state_id] = set()
             clicked_ids = state_memory[state_id]
-            
+
             is_new = state_id not in visited
             if is_new:
                 visited.add(state_id)
+                near_index.add(state['simhash'], state_id, state['dom']['url'])
+                log.record_state(state_id, state['simhash'], state['dom']['url'])
                 print(f"✨ New state: {state['summary']} (states={len(visited)})")
             else:
                 print(f"♻️  Seen state: {state['summary']} (clicked {len(clicked_ids)} elements here)")
 
             # Plan actions with memory of clicked elements (優先級3 - 狀態內記憶)
-            actions = plan_actions(state, clicked_ids)
+            # Kick off the LLM call first and capture the rest of the state while it is in flight
+            if batcher is not None:
+                plan_task = asyncio.create_task(batcher.plan(state, clicked_ids))
+            else:
+                plan_task = asyncio.create_task(plan_actions(state, clicked_ids, llm, plan_cache))
+            await observe_extras(page, state)
+            actions = await plan_task
             acted = False
-            
+
             for a in actions[:3]:
                 print(f"🤖 LLM suggested: {a}")
                 for t in range(ACTION_TRY_LIMIT):
-                    res = find_and_act(page, a, state['dom']['clickables'], state['dom'].get('fillables', []))
+                    res = await find_and_act(page, a, state['dom']['clickables'], state['dom'].get('fillables', []))
                     if res.get('ok'):
                         acted = True
                         # Record the element as clicked in this state
                         if res.get('target_id') is not None:
                             clicked_ids.add(res['target_id'])
-                        
-                        time.sleep(0.8)
-                        new_state = observe(page)
-                        new_id = new_state['dom_finger']
-                        transitions.append({'from': state_id, 'to': new_id, 'action': a})
+
+                        # Fills don't navigate; everything else waits for the page to settle
+                        if res.get('action') != 'fill':
+                            await wait_for_settle(page)
+                        new_state = await observe_dom(page)
+                        new_id = resolve_state_id(new_state)
+                        transition = {'from': state_id, 'to': new_id, 'action': a}
+                        transitions.append(transition)
+                        log.record_transition(transition)
                         print(f'✓ Action executed, transition to state {new_id[:16]}...')
                         break
                     else:
@@ -313,24 +708,20 @@ def run(target_url: str):
             # Improved fallback: randomly click an unclicked element (優先級3)
             if not acted:
                 print('🔄 No action executed by LLM; fallback to random unclicked element')
-                
-                # Collect all clickable element IDs
-                all_clickable_ids = [c.get('element_id') for c in state['dom']['clickables'] if c.get('element_id') is not None]
-                
-                # Filter out already clicked ones
-                unclicked = [eid for eid in all_clickable_ids if eid not in clicked_ids]
-                
-                if unclicked:
-                    # Randomly pick one
-                    chosen_id = random.choice(unclicked)
+
+                # Filter out already clicked ones and pick one at random, all inside the browser
+                clickable_ids = [c['element_id'] for c in state['dom']['clickables']]
+                chosen_id = await page.evaluate(_PICK_UNCLICKED_JS, [clickable_ids, list(clicked_ids)])
+
+                if chosen_id is not None:
                     print(f'  🎲 Randomly trying unclicked element ID:{chosen_id}')
-                    
+
                     fallback_action = {'action_type': 'click', 'target_id': chosen_id}
-                    res = find_and_act(page, fallback_action, state['dom']['clickables'], state['dom'].get('fillables', []))
-                    
+                    res = await find_and_act(page, fallback_action, state['dom']['clickables'], state['dom'].get('fillables', []))
+
                     if res.get('ok'):
                         clicked_ids.add(chosen_id)
-                        time.sleep(0.6)
+                        await wait_for_settle(page)
                         print(f'  ✓ Fallback click succeeded')
                     else:
                         print(f'  ✗ Fallback click failed: {res.get("reason")}')
@@ -338,20 +729,105 @@ def run(target_url: str):
                     print('  ⚠ No unclicked elements available. Stopping.')
                     break
 
-            if len(visited) > 200:
+            # Only states found in this run count; resumed ones must not end the crawl early
+            if len(visited) - resumed > 200:
                 print('🛑 Visited limit reached, stopping.')
                 break
-
-        print(f'\n🏁 Crawl finished.')
-        print(f'   Unique states discovered: {len(visited)}')
-        print(f'   Total transitions: {len(transitions)}')
-        print(f'   Total elements interacted: {sum(len(ids) for ids in state_memory.values())}')
-        browser.close()
+    finally:
+        log.flush()
+        await context.close()
+
+    return {'url': target_url, 'visited': visited, 'transitions': list(transitions), 'state_memory': state_memory}
+
+
+def disable_playwright_stack_capture():
+    """Make Playwright's per-call inspect.stack() cheap.
+
+    inspect.stack() resolves the source file and module of every frame, which is a
+    large share of the client-side CPU in a busy crawler. Playwright only needs each
+    frame's object, filename and line to derive the API name (used in error messages
+    such as "Locator.click: Timeout ...") and trace frames, so build just that from
+    sys._getframe. Only the `inspect` reference inside Playwright's connection module
+    is replaced.
+    """
+    import inspect
+    from playwright._impl import _connection
+
+    class _CheapStackInspect:
+        def __getattr__(self, name):
+            return getattr(inspect, name)
+
+        @staticmethod
+        def stack(*args, **kwargs):
+            frames = []
+            f = sys._getframe(1)
+            while f is not None:
+                frames.append(inspect.FrameInfo(f, f.f_code.co_filename, f.f_lineno, f.f_code.co_name, None, None))
+                f = f.f_back
+            return frames
+
+    _connection.inspect = _CheapStackInspect()
+
+
+async def crawl(target_urls: List[str], concurrency: int = CRAWL_CONCURRENCY) -> List[Dict[str, Any]]:
+    """Crawl a queue of URLs on one browser launch, up to `concurrency` contexts at a time.
+
+    Each URL gets a fresh browser context (isolated cookies/storage) that is closed when
+    its crawl ends; the browser and LLM client are shared by all of them.
+    """
+    # One LLM client for the whole crawl; reused across all steps and contexts
+    llm = make_llm()
+    workers = max(1, min(concurrency, len(target_urls)))
+    # dom_finger includes the page URL, so one cache can be shared by all contexts
+    plan_cache = PlanCache()
+    # Merge planner prompts across contexts only when there is more than one
+    batcher = PlanBatcher(llm, plan_cache) if workers > 1 else None
+
+    if not PW_INSPECT_STACK:
+        disable_playwright_stack_capture()
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=False)
+        queue = deque(enumerate(target_urls))
+        results = [None] * len(target_urls)
+
+        async def worker():
+            while queue:
+                i, url = queue.popleft()
+                # One failing URL (e.g. a net:: error on goto) must not tear down the others
+                try:
+                    results[i] = await crawl_context(browser, url, llm, batcher, plan_cache)
+                except Exception as e:
+                    print(f'❌ Crawl failed for {url}: {e}')
+                    results[i] = {'url': url, 'error': str(e)}
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+
+        for r in results:
+            if 'error' in r:
+                print(f'\n❌ Crawl failed: {r["url"]}')
+                print(f'   Error: {r["error"]}')
+                continue
+            print(f'\n🏁 Crawl finished: {r["url"]}')
+            print(f'   Unique states discovered: {len(r["visited"])}')
+            print(f'   Total transitions: {len(r["transitions"])}')
+            print(f'   Total elements interacted: {sum(len(ids) for ids in r["state_memory"].values())}')
+        await browser.close()
+    return results
+
+
+def run_many(target_urls: List[str], concurrency: int = CRAWL_CONCURRENCY) -> List[Dict[str, Any]]:
+    return asyncio.run(crawl(target_urls, concurrency))
+
+
+def run(*target_urls: str):
+    # The `usagi` console script calls run() with no arguments; take the URLs from argv then
+    urls = list(target_urls) or sys.argv[1:]
+    if not urls:
+        print('Usage: usagi <target_url> [<target_url> ...]')
+        sys.exit(1)
+    return run_many(urls)
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print('Usage: python llm_gui_crawler.py <target_url>')
-        sys.exit(1)
-    target = sys.argv[1]
-    run(target)
+    run(*sys.argv[1:])